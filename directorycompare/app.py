@@ -8,21 +8,26 @@
 
 import logging
 
+from directorycompare import utils
 from directorycompare.directorycompare import (
     ArgCommandParse,
     AnalyseDirectory,
     CompareSources,
 )
 
-logging.basicConfig(filename=("logs/app.log"), level=logging.DEBUG)
+# Command name to the class handling it and the method which runs it
+COMMANDS = {
+    "source": (AnalyseDirectory, "analyse"),
+    "compare": (CompareSources, "compare"),
+}
 
 
 def run():
     args = ArgCommandParse()
-    if args.command == "source":
-        action = AnalyseDirectory(args.options)
-        action.analyse()
-    elif args.command == "compare":
-        action = CompareSources(args.options)
-        action.compare()
+    # Debug logging is opt in as it is issued for every folder scanned
+    level = logging.DEBUG if args.options["verbose"] else logging.WARNING
+    utils.setup_logging(level)
+    handler, method = COMMANDS[args.command]
+    action = handler(args.options)
+    getattr(action, method)()
     print(f"Success!")
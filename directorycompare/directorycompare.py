@@ -2,12 +2,44 @@ import sys
 import logging
 import argparse
 import os
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+)
+from itertools import repeat
+from operator import itemgetter
 from pathlib import Path
 from directorycompare import utils
 
-IMAGE_FORMATS = {".jpg", ".jpeg", ".png"}
-RAW_FORMATS = {".arw"}
+log = logging.getLogger(__name__)
+
+IMAGE_FORMATS = frozenset({".jpg", ".jpeg", ".png"})
+RAW_FORMATS = frozenset({".arw"})
+# Lower case suffix to the file type it is recorded under
+_KIND = dict.fromkeys(IMAGE_FORMATS, "images")
+_KIND.update(dict.fromkeys(RAW_FORMATS, "raws"))
+FIELDNAMES = ("name", "path", "size")
+# Columns held per file type, folder indexes the scanned folder table
+COLUMNS = ("name", "folder", "size")
 VERSION = "0.01"
+# Folders scanned at once, raise for high latency network mounts
+MAX_WORKERS = 16
+
+
+def positive_int(value):
+    """
+        argparse type for counts which must be at least one.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
 
 
 class ArgCommandParse(object):
@@ -15,77 +47,184 @@ class ArgCommandParse(object):
         Parsing command line arguments to perform tasks for directory
         based comparing.
 
-        Based on:
-        https://chase-seibert.github.io/blog/2014/03/21/python-multilevel-argparse.html#
+        Each command is a subparser so the command line is parsed once.
     """
 
     def __init__(self):
         """
-            Multi-level argument parsing based upon command issued.
+            Argument parsing based upon command issued.
         """
         self.command = ""
         self.options = {}
-        parser = argparse.ArgumentParser(
-            description="Directory equality checker",
-            usage="""Commands: source
-                 compare""",
+        # Options shared by every command
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument(
+            "--verbose", action="store_true", help="Log debug messages"
         )
-        parser.add_argument("command", help="Task to run")
-        args = parser.parse_args(sys.argv[1:2])
-        if not hasattr(self, args.command):
-            print(f"Command not recognised")
-            parser.print_help()
-            exit(1)
-        # use dispatch pattern to invoke method with same name
-        getattr(self, args.command)()
-
-    def source(self):
-        """
-            source command.
-            Requring a name and at least one folder location.
-        """
-        self.command = "source"
         parser = argparse.ArgumentParser(
-            description="Adds a new source directory."
+            description="Directory equality checker"
+        )
+        commands = parser.add_subparsers(
+            dest="command", metavar="command", help="Task to run"
         )
-        parser.add_argument(
+        commands.required = True
+        source = commands.add_parser(
+            "source",
+            parents=[common],
+            description="Adds a new source directory.",
+            help="Analyse folders as a named source",
+        )
+        source.add_argument(
             "name", metavar="name", type=str, nargs=1, help="Name for source"
         )
-        parser.add_argument(
+        source.add_argument(
             "folder",
             metavar="path",
             type=str,
             nargs="+",
             help="Path to folder to be processed",
         )
-        args = parser.parse_args(sys.argv[2:])
+        source.add_argument(
+            "--workers",
+            metavar="count",
+            type=positive_int,
+            default=MAX_WORKERS,
+            help="Number of folders scanned at once",
+        )
+        compare = commands.add_parser(
+            "compare",
+            parents=[common],
+            description="Name sources already analysed.",
+            help="Compare two named sources",
+        )
+        compare.add_argument(
+            "source", metavar="name", type=str, nargs=2, help="Source name"
+        )
+        args = parser.parse_args(sys.argv[1:])
+        # use dispatch pattern to invoke method with same name
+        getattr(self, args.command)(args)
+
+    def source(self, args):
+        """
+            source command.
+            Requring a name and at least one folder location.
+        """
+        self.command = "source"
         paths = []
         for folder in args.folder:
-            paths.append(utils.convert_to_path(folder))
+            paths.append(utils.convert_to_path(folder, resolve=True))
 
         self.options = {
             "command": "source",
             "name": args.name[0],
             "paths": paths,
+            "workers": args.workers,
+            "verbose": args.verbose,
         }
-        logging.debug(
-            "Adding new %s: %s", str(self.command), str(self.options["name"])
-        )
 
-    def compare(self):
+    def compare(self, args):
         self.command = "compare"
-        parser = argparse.ArgumentParser(
-            description="Name sources already analysed."
-        )
-        parser.add_argument(
-            "source", metavar="name", type=str, nargs=2, help="Source name"
-        )
-        args = parser.parse_args(sys.argv[2:])
-        sources = []
-        for source in args.source:
-            sources.append(source)
+        self.options = {
+            "command": "compare",
+            "sources": list(args.source),
+            "verbose": args.verbose,
+        }
+
+
+def new_columns():
+    """
+        Empty file columns, one list per field. Values at the same index
+        belong to the same file.
+    """
+    return {field: [] for field in COLUMNS}
+
 
-        self.options = {"command": "compare", "sources": sources}
+def extend_columns(files, new_files, offset):
+    """
+        Append the columns of each file type in new_files onto files.
+
+        Folder ids in new_files are shifted by offset, the position their
+        folder table starts at within the table files refers to.
+    """
+    for key, columns in new_files.items():
+        found = files[key]
+        found["name"].extend(columns["name"])
+        found["size"].extend(columns["size"])
+        found["folder"].extend(x + offset for x in columns["folder"])
+
+
+def walk_folders(paths, workers):
+    """
+        Go through specified folders and find all images separting raw image
+        files, recording name, folder and size of each.
+
+        Folders are scanned concurrently, each finished folder queues up
+        the folders nested within it. Only a couple of scans per worker
+        are submitted at a time, the rest wait as plain paths. Results
+        are only collected on this thread so no locking is needed.
+
+        Returns file columns per type and the table of folders scanned,
+        which the folder column indexes.
+    """
+    files = {"images": new_columns(), "raws": new_columns()}
+    folder_table = []
+    folder_list = list(paths)
+    in_flight = 2 * workers
+    # future to the folder it is scanning
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while folder_list or pending:
+            while folder_list and len(pending) < in_flight:
+                folder = folder_list.pop()
+                future = executor.submit(process_folder, folder)
+                pending[future] = folder
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_id = len(folder_table)
+                folder_table.append(os.fspath(pending.pop(future)))
+                contents, folders = future.result()
+                folder_list.extend(folders)
+                extend_columns(files, contents, folder_id)
+    return files, folder_table
+
+
+def process_folder(folder):
+    """
+        Takes a specific folder and returns file columns for images, raw
+        separate and nested folders. The folder id of each file is 0, the
+        folder scanned.
+
+        Size is taken from the directory entry as the folder is read so
+        each file is only visited once.
+    """
+    contents = {"images": new_columns(), "raws": new_columns()}
+    folders = []
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Processing folder: %s", folder)
+    # DirEntry caches the file type from the directory listing so no
+    # extra stat is needed to tell files and folders apart
+    with utils.scan_folder(folder) as entries:
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(os.path.join(folder, name))
+                continue
+            dot = name.rfind(".")
+            kind = _KIND.get(name[dot:].lower()) if dot > 0 else None
+            if kind is not None and entry.is_file(follow_symlinks=False):
+                columns = contents[kind]
+                columns["name"].append(name)
+                columns["size"].append(
+                    entry.stat(follow_symlinks=False).st_size
+                )
+    for columns in contents.values():
+        columns["folder"] = [0] * len(columns["name"])
+    if debug:
+        log.debug("Found folders: %.0f", len(folders))
+        log.debug("Found images: %.0f", len(contents["images"]["name"]))
+        log.debug("Found raws: %.0f", len(contents["raws"]["name"]))
+    return contents, folders
 
 
 class AnalyseDirectory:
@@ -99,12 +238,20 @@ class AnalyseDirectory:
     def __init__(self, commandline):
         self.name = commandline["name"]
         self.paths = commandline["paths"]
+        self.workers = commandline["workers"]
         self.file_data = {}
+        # Folders scanned, files refer to their folder by index
+        self.folder_table = []
         self.output_folder = Path(utils.DATA_FOLDER) / self.name
+        # Old data is cleared in the background while folders are scanned
+        self.clearing = None
         if self.output_folder.is_dir():
-            utils.remove_recursive(self.output_folder)
+            self.clearing = threading.Thread(
+                target=utils.remove_recursive, args=(self.output_folder,)
+            )
+            self.clearing.start()
         print(f"Adding new source: {self.name}")
-        logging.info("Adding new source: %s", self.name)
+        log.info("Adding new source: %s", self.name)
         # Records number of folders, images etc found
         self.processed = {}
 
@@ -113,126 +260,128 @@ class AnalyseDirectory:
             Using folder paths found, retrieve stats for files
             contained within and save data to csv.
         """
-        files = self.gather_files()
-        self.retrieve_stats(files)
-        self.sort_data()
+        self.file_data = self.gather_files()
+        if self.clearing is not None:
+            self.clearing.join()
         self.save_data_to_file()
         self.save_index_data()
 
     def gather_files(self):
         """
-            Go through specified folders and find all images separting raw image
-            files.
+            Find all images and raw files within the source folders.
+
+            With more than one source folder each is walked in its own
+            process, so the per file work is not held to one core by the
+            GIL. A single folder is walked on threads in this process.
+            The workers are shared out between the processes so no more
+            than that many folders are scanned at once overall.
+            Processes are spawned rather than forked as old data may be
+            being cleared on another thread.
         """
         print(f"Searching folders")
-        folder_list = self.paths.copy()
-        images = []
-        raws = []
-        folders_found = 0
-        while folder_list:
-            contents, folders = self.process_folder(folder_list.pop())
-            folder_list.extend(folders)
-            images.extend(contents["images"])
-            raws.extend(contents["raws"])
-            folders_found += 1
+        processes = min(len(self.paths), os.cpu_count() or 1, self.workers)
+        if processes > 1:
+            level = logging.getLogger().getEffectiveLevel()
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=utils.setup_logging,
+                initargs=(level,),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        walk_folders,
+                        [[path] for path in self.paths],
+                        repeat(self.workers // processes),
+                    )
+                )
+        else:
+            results = [walk_folders(self.paths, self.workers)]
+
+        files = {"images": new_columns(), "raws": new_columns()}
+        for tree_files, tree_folders in results:
+            extend_columns(files, tree_files, len(self.folder_table))
+            self.folder_table.extend(tree_folders)
+        self.order_folders(files)
 
+        images = len(files["images"]["name"])
+        raws = len(files["raws"]["name"])
         self.processed = {
-            "folders": folders_found,
-            "files": {
-                "total": len(images) + len(raws),
-                "images": len(images),
-                "raws": len(raws),
-            },
+            "folders": len(self.folder_table),
+            "files": {"total": images + raws, "images": images, "raws": raws},
         }
-        files = {"images": images, "raws": raws}
-        logging.debug("Total images found: %.0f", len(images))
-        logging.debug("Total raws found: %.0f", len(raws))
+        log.debug("Total images found: %.0f", images)
+        log.debug("Total raws found: %.0f", raws)
         return files
 
-    def process_folder(self, folder):
-        """
-            Takes a specific folder and returns a list of images, raw separate
-            and nested folders.
-        """
-        # TODO: replace standalone lists to be dictionary of lists directly
-        raws = []
-        images = []
-        folders = []
-        logging.debug("Processing folder: %s", folder)
-        for child in folder.iterdir():
-            if child.suffix.lower() in IMAGE_FORMATS and child.is_file():
-                images.append(child)
-            elif child.suffix.lower() in RAW_FORMATS and child.is_file():
-                raws.append(child)
-            elif child.is_dir():
-                folders.append(Path(child))
-        logging.debug("Found folders: %.0f", len(folders))
-        logging.debug("Found images: %.0f", len(images))
-        logging.debug("Found raws: %.0f", len(raws))
-        contents = {"images": images, "raws": raws}
-        return contents, folders
-
-    def retrieve_stats(self, files):
+    def order_folders(self, files):
         """
-            Retrieve information about the file.
+            Sort folder_table by path and renumber the folder column of
+            files to match.
 
-            Image files can be analysed for further information compared with
-            raw files.
+            Folders are added as scans complete, so this keeps the ids and
+            therefore the output independent of scan order.
         """
-        print(f"Analysing files")
-        logging.info("Analysing files")
-        # for raws
-        output_raw = []
-        for path in files["raws"]:
-            full_path = Path(Path.home(), path)
-            file_info = os.stat(full_path)
-            output_raw.append(
-                {
-                    "name": path.name,
-                    "path": str(full_path),
-                    "size": file_info.st_size,
-                }
-            )
-        # for images
-        output_images = []
-        for path in files["images"]:
-            full_path = Path(Path.home(), path)
-            file_info = os.stat(full_path)
-            output_images.append(
-                {
-                    "name": path.name,
-                    "path": str(full_path),
-                    "size": file_info.st_size,
-                }
-            )
-        self.file_data = {"images": output_images, "raws": output_raw}
-        logging.debug("Images analysed: %.0f", len(output_images))
-        logging.debug("Raws analysed: %.0f", len(output_raw))
+        table = self.folder_table
+        order = sorted(range(len(table)), key=table.__getitem__)
+        new_ids = [0] * len(order)
+        for new_id, old_id in enumerate(order):
+            new_ids[old_id] = new_id
+        self.folder_table = [table[i] for i in order]
+        for columns in files.values():
+            columns["folder"] = [new_ids[i] for i in columns["folder"]]
 
-    def sort_data(self):
+    def sort_data(self, key):
         """
-            file_data is sorted into ascending order
+            file_data for key is sorted into ascending order by name, files
+            sharing a name are ordered by folder
+
+            The order is found once from the names and folders and then
+            applied to every column. Sorting is stable so sorting by folder
+            then by name gives both orders.
         """
-        self.file_data["images"] = sorted(
-            self.file_data["images"], key=lambda i: i["name"]
-        )
-        self.file_data["raws"] = sorted(
-            self.file_data["raws"], key=lambda i: i["name"]
-        )
+        columns = self.file_data[key]
+        names = columns["name"]
+        order = sorted(range(len(names)), key=columns["folder"].__getitem__)
+        order.sort(key=names.__getitem__)
+        for field, values in columns.items():
+            columns[field] = [values[i] for i in order]
 
     def save_data_to_file(self):
         """
-            Save dictionary data to files based upon key name in folder
+            Save column data to files based upon key name in folder
             output_folder.
+
+            Each file type is sorted and written on its own thread so one
+            file can be flushed while the other is still being sorted.
         """
-        logging.info("Saving files to %s", self.output_folder)
+        log.info("Saving files to %s", self.output_folder)
         utils.create_folders(self.output_folder)
-        fieldnames = ["name", "path", "size"]
-        for key in self.file_data.keys():
-            path = self.output_folder / (key + ".csv")
-            utils.write_csv(self.file_data[key], path, fieldnames)
+        with ThreadPoolExecutor(max_workers=len(self.file_data)) as executor:
+            futures = [
+                executor.submit(self.save_file, key) for key in self.file_data
+            ]
+            for future in as_completed(futures):
+                future.result()
         print(f"Saved under {self.output_folder}")
 
+    def save_file(self, key):
+        """
+            Sort a single file type and save it to a csv named after key.
+
+            Full paths are only built from the folder table as rows are
+            written.
+        """
+        self.sort_data(key)
+        columns = self.file_data[key]
+        folder_table = self.folder_table
+        path = self.output_folder / (key + ".csv")
+        rows = (
+            (name, os.path.join(folder_table[folder], name), size)
+            for name, folder, size in zip(*(columns[x] for x in COLUMNS))
+        )
+        utils.write_csv(rows, path, FIELDNAMES)
+
     def save_index_data(self):
         """
             Save index information about the source to a single file.
@@ -261,7 +410,7 @@ class CompareSources:
         self.output_folder = Path(utils.DATA_FOLDER) / "comparisons"
         # output file named from both sources separated by underscore
         self.output_file = f"{self.sources[0]}_{self.sources[1]}"
-        logging.info(
+        log.info(
             "Comparing sources: %s %s", self.sources[0], self.sources[1]
         )
 
@@ -307,17 +456,17 @@ class CompareSources:
             value: file data as a dictionary
         """
         try:
-            logging.debug("Sourcing: %s", source)
+            log.debug("Sourcing: %s", source)
             path = Path.cwd() / utils.DATA_FOLDER / source
             files = os.listdir(path)
             dictionary = {}
             # only load csv files
-            files = [x for x in files if Path(x).suffix == ".csv"]
+            files = [x for x in files if x.endswith(".csv")]
             for item in files:
                 new_path = Path(path / item)
                 file_data = utils.read_csv(new_path)
                 dictionary.update({new_path.stem: file_data})
-                logging.debug("Found type: %s", new_path.stem)
+                log.debug("Found type: %s", new_path.stem)
             return dictionary
         except OSError as error:
             print(error)
@@ -326,15 +475,41 @@ class CompareSources:
         """
             Save differences found to a file
         """
-        logging.info("Saving files to %s", self.output_folder)
+        log.info("Saving files to %s", self.output_folder)
         utils.create_folders(self.output_folder)
         # output_path = self.output_folder /
-        fieldnames = ["name", "path", "size"]
         path = self.output_folder / (self.output_file + ".csv")
-        utils.write_csv(self.differences, path, fieldnames)
+        rows = map(itemgetter(*FIELDNAMES), self.differences)
+        utils.write_csv(rows, path, FIELDNAMES)
         print(f"Saved to {path}")
 
 
+def index_by_name(records):
+    """
+        Group records by name keeping every record. Records sharing a name
+        stay in the order given.
+    """
+    index = {}
+    for record in records:
+        index.setdefault(record["name"], []).append(record)
+    return index
+
+
+def unpaired(records, paired):
+    """
+        Records left once those with a same size partner are taken out.
+
+        paired counts the partners available for each size and is used up.
+    """
+    left = []
+    for record in records:
+        if paired[record["size"]]:
+            paired[record["size"]] -= 1
+        else:
+            left.append(record)
+    return left
+
+
 class FindDifferences:
     """
         Find differences between two lists
@@ -352,54 +527,30 @@ class FindDifferences:
         """
             Returns list of records which are not present in both source.
 
-            First checking membership of items in A into the B
-            and then vice versa. Any items which aren't found in both are
-            added to a new list which is returned.
-        """
-        # Brute force simple membership check once for all items in list A
-        # a second time for all items in list B.
-        for key, value in self.A.items():
-            for record in self.A[key]:
-                found_record = next(
-                    (
-                        item
-                        for item in self.B[key]
-                        if item["name"] == record["name"]
-                    ),
-                    None,
-                )
-                if found_record is None:
-                    logging.debug("Found difference: ")  # + record)
-                    self.differences.append(record)
-                else:
-                    if found_record["size"] != record["size"]:
-                        logging.debug("Found difference: ")  # + found_record)
-                        self.differences.append(found_record)
-        for key, value in self.B.items():
-            for record in self.B[key]:
-                found_record = next(
-                    (
-                        item
-                        for item in self.A[key]
-                        if item["name"] == record["name"]
-                    ),
-                    None,
+            Records of each file type are grouped by name for both sources
+            and the records of a name are paired by size. A record with a
+            partner of the same size in the other source is never reported.
+            Where both sources are left with unpaired records of a name
+            these are size mismatches, reported using the records from A.
+            Any surplus records on the side with more are reported as is,
+            including every record of a name found in only one source.
+        """
+        for key in sorted(self.A.keys() | self.B.keys()):
+            a_map = index_by_name(self.A.get(key, []))
+            b_map = index_by_name(self.B.get(key, []))
+            for name, records in a_map.items():
+                found_records = b_map.get(name, [])
+                paired = Counter(item["size"] for item in records) & Counter(
+                    item["size"] for item in found_records
                 )
-                if found_record is None:
-                    logging.debug("Found difference: ")  # + record)
-                    self.differences.append(record)
-                else:
-                    if found_record["size"] != record["size"]:
-                        logging.debug("Found difference: ")  # + found_record)
-                        self.differences.append(found_record)
-
-        logging.debug("Finished comparing files")
-        logging.debug("Found %s files", len(self.differences))
+                a_left = unpaired(records, paired.copy())
+                b_left = unpaired(found_records, paired)
+                self.differences.extend(a_left)
+                self.differences.extend(b_left[len(a_left):])
+            for name, records in b_map.items():
+                if name not in a_map:
+                    self.differences.extend(records)
+
+        log.debug("Finished comparing files")
+        log.debug("Found %s files", len(self.differences))
         return self.differences
-
-    def hash_check(self):
-        """
-            Use a hashing function to test whether or not a dictionary item
-            matches.
-        """
-        pass
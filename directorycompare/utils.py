@@ -2,23 +2,42 @@ import os
 import logging
 from pathlib import Path
 import csv
+from contextlib import contextmanager
 import yaml
 
+log = logging.getLogger(__name__)
+
 # Globals
 DATA_FOLDER = "data"
 LOG_FOLDER = "logs"
 
 
+# Working directory the program was started from
+_CWD = Path.cwd()
+
+
 # Functions
-def convert_to_path(folder_path):
+def setup_logging(level):
+    """
+        Log to the app log file within LOG_FOLDER at the given level.
+    """
+    logging.basicConfig(filename=(Path(LOG_FOLDER) / "app.log"), level=level)
+
+
+def convert_to_path(folder_path, resolve=False):
     """
         Convert a string to Path either from root or current directory
+
+        Relative paths are only resolved when requested as resolving
+        stats every component of the path.
     """
     path = Path(folder_path)
     if path.is_absolute():
         return path
-    else:
-        return Path(Path.cwd() / path).resolve()
+    path = _CWD / path
+    if resolve:
+        return path.resolve()
+    return path
 
 
 def remove_recursive(path):
@@ -28,17 +47,28 @@ def remove_recursive(path):
         Requires folder in path form.
         Includes removal of first supplied path.
     """
-    logging.debug("remove_recursive: path: %s", path)
+    log.debug("remove_recursive: path: %s", path)
     if path.is_file():
         remove_file(path)
-    else:
-        while os.listdir(path):
-            item = os.listdir(path)[0]
-            item = path / item
-            item = convert_to_path(item)
-            logging.debug("item: %s", item)
-            remove_recursive(item)
-        remove_folder(path)
+        return
+    # Walk with a stack rather than recursing so deep trees cannot hit the
+    # recursion limit. A folder is revisited once its contents are removed.
+    stack = [(path, False)]
+    while stack:
+        folder, emptied = stack.pop()
+        if emptied:
+            remove_folder(folder)
+            continue
+        stack.append((folder, True))
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, False))
+                    else:
+                        remove_file(entry.path)
+        except OSError as error:
+            print(error)
 
 
 def remove_file(item):
@@ -47,7 +77,7 @@ def remove_file(item):
     """
     try:
         os.remove(item)
-        logging.debug("File removed: %s", item)
+        log.debug("File removed: %s", item)
     except OSError as error:
         print(error)
 
@@ -58,11 +88,32 @@ def remove_folder(folder):
     """
     try:
         os.rmdir(folder)
-        logging.debug("Folder removed: %s", folder)
+        log.debug("Folder removed: %s", folder)
     except OSError as error:
         print(error)
 
 
+@contextmanager
+def scan_folder(folder):
+    """
+        Iterate folder entries as os.scandir does.
+
+        Where supported the folder is scanned through an open descriptor so
+        entry stats are looked up relative to it (fstatat) rather than
+        walking the full path again. Entry path is then only the name.
+    """
+    if os.scandir not in os.supports_fd:
+        with os.scandir(folder) as entries:
+            yield entries
+        return
+    fd = os.open(folder, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        with os.scandir(fd) as entries:
+            yield entries
+    finally:
+        os.close(fd)
+
+
 def create_folders(folder):
     """
         Create folders supplied as a Path
@@ -70,7 +121,7 @@ def create_folders(folder):
     """
     try:
         os.makedirs(folder)
-        logging.debug("Created folder: %s", folder)
+        log.debug("Created folder: %s", folder)
     except OSError:
         pass
 
@@ -90,16 +141,18 @@ def read_csv(filepath):
     return data
 
 
-def write_csv(data, filepath, fieldnames):
+def write_csv(rows, filepath, fieldnames):
     """
-        Write CSV file from dictionary to file.
+        Write CSV file from rows to file.
+
+        Each row is a sequence of values in fieldnames order, handed to
+        writerows so the per row loop runs within the csv module.
     """
-    logging.debug("Writing to file: %s", str(filepath))
-    with open(filepath, "w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in data:
-            writer.writerow(row)
+    log.debug("Writing to file: %s", str(filepath))
+    with open(filepath, "w", newline="", buffering=1 << 20) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
 
 
 def read_yaml(path):
@@ -109,7 +162,7 @@ def read_yaml(path):
         If no file exists nothing happens
     """
     if not path.is_file():
-        logging.debug("File not found %s. No action taken", path)
+        log.debug("File not found %s. No action taken", path)
         return
     try:
         with path.open('r') as f:
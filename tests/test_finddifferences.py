@@ -0,0 +1,44 @@
+import unittest
+
+from directorycompare.directorycompare import FindDifferences
+
+
+def record(name, path, size):
+    return {"name": name, "path": path, "size": size}
+
+
+def differences(source1, source2):
+    check = FindDifferences({"images": source1}, {"images": source2})
+    return [item["path"] for item in check.manual_check()]
+
+
+class ManualCheckTest(unittest.TestCase):
+    def test_matching_duplicate_not_reported(self):
+        source1 = [record("x.jpg", "A/f1", "2"), record("x.jpg", "A/f2", "3")]
+        source2 = [record("x.jpg", "B/f1", "2")]
+        self.assertEqual(differences(source1, source2), ["A/f2"])
+
+    def test_unpaired_duplicates_reported_once_from_a(self):
+        source1 = [record("x.jpg", "A/f1", "2"), record("x.jpg", "A/f2", "3")]
+        source2 = [record("x.jpg", "B/f1", "2"), record("x.jpg", "B/f2", "5")]
+        self.assertEqual(differences(source1, source2), ["A/f2"])
+
+    def test_surplus_reported_from_side_with_more(self):
+        source1 = [record("x.jpg", "A/f1", "3")]
+        source2 = [
+            record("x.jpg", "B/f1", "2"),
+            record("x.jpg", "B/f2", "5"),
+            record("x.jpg", "B/f3", "3"),
+        ]
+        self.assertEqual(differences(source1, source2), ["B/f1", "B/f2"])
+
+    def test_names_in_one_source_reported(self):
+        source1 = [record("a.jpg", "A/a", "1"), record("a.jpg", "A/b", "1")]
+        source2 = [record("b.jpg", "B/b", "1")]
+        self.assertEqual(
+            differences(source1, source2), ["A/a", "A/b", "B/b"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()